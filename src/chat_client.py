@@ -7,7 +7,13 @@ Việc sử dụng lớp này giúp cho việc quản lý danh sách client ở
 trở nên rõ ràng và có tổ chức hơn, thay vì chỉ lưu trữ các đối tượng socket.
 """
 
+from collections import deque
+from itertools import islice
 from socket import socket
+import threading
+
+from configs import OUTBOX_LIMIT, SEND_BATCH_FRAMES
+from utils import NONBLOCKING_SEND_FLAGS, FrameReader
 
 
 class ChatClient:
@@ -17,8 +23,28 @@ class ChatClient:
     Attributes:
         socket (socket): Đối tượng socket của client.
         username (str): Tên người dùng của client (được gán sau khi xác thực).
+        address: Địa chỉ (IP, port) của client, lấy khi vừa kết nối.
+        reader (FrameReader): Bộ đọc frame với bộ đệm nhận cấp phát sẵn,
+            dùng lại cho mọi lần nhận.
+        outbox (deque): Hàng đợi các frame chờ gửi đến client.
+        tx_lock (threading.Lock): Đảm bảo chỉ một luồng gửi dữ liệu tại một thời điểm.
+        dead (bool): True khi kết nối đã hỏng và đang chờ được dọn dẹp.
+        closed (bool): True khi kết nối đã được dọn dẹp (socket sắp/đã đóng).
     """
 
+    # Dùng __slots__ thay cho __dict__ để giảm bộ nhớ cho mỗi client
+    # và truy cập thuộc tính nhanh hơn trong vòng lặp broadcast
+    __slots__ = (
+        "socket",
+        "username",
+        "address",
+        "reader",
+        "outbox",
+        "tx_lock",
+        "dead",
+        "closed",
+    )
+
     def __init__(self, socket: socket):
         """
         Khởi tạo một đối tượng ChatClient mới.
@@ -28,6 +54,82 @@ class ChatClient:
         """
         self.socket = socket
         self.username: str = None  # Sẽ được gán sau khi đăng nhập thành công
+        # Lưu địa chỉ ngay từ đầu, vì sau khi ngắt kết nối không lấy lại được
+        try:
+            self.address = socket.getpeername()
+        except OSError:
+            self.address = "N/A (đã ngắt kết nối)"
+        # Bộ đệm nhận chỉ cấp phát một lần cho mỗi client, tránh tạo
+        # một đối tượng bytes mới cho mỗi lần gọi recv()
+        self.reader = FrameReader()
+        self.outbox = deque()
+        self.tx_lock = threading.Lock()
+        self.dead = False
+        self.closed = False
+
+    def queue_frame(self, data: bytes) -> bool:
+        """
+        Thêm một frame vào hàng đợi gửi, sau đó gửi ngay những gì có thể gửi
+        mà không phải chờ.
+
+        Args:
+            data (bytes): Frame cần gửi.
+
+        Returns:
+            bool: True nếu hàng đợi đã được gửi hết, False nếu bộ đệm gửi
+                  của socket đang đầy và vẫn còn dữ liệu chờ.
+
+        Raises:
+            ConnectionError: Nếu hàng đợi đã đầy (client nhận quá chậm).
+        """
+        if len(self.outbox) >= OUTBOX_LIMIT:
+            raise ConnectionError("Outbox is full, client is too slow.")
+        self.outbox.append(data)
+        return self.flush()
+
+    def flush(self) -> bool:
+        """
+        Gửi dữ liệu trong hàng đợi mà không chờ socket.
+
+        Returns:
+            bool: True nếu hàng đợi đã trống, False nếu vẫn còn dữ liệu chờ
+                  (bộ đệm gửi của socket đang đầy, hoặc một luồng khác đang gửi).
+        """
+        while self.outbox:
+            if not self.tx_lock.acquire(blocking=False):
+                return False
+            try:
+                while self.outbox:
+                    try:
+                        sent = self._send_batch()
+                    except BlockingIOError:
+                        return False
+                    # Bỏ các frame đã gửi hết khỏi hàng đợi
+                    while sent and sent >= len(self.outbox[0]):
+                        sent -= len(self.outbox.popleft())
+                    if sent:
+                        # Chỉ gửi được một phần, giữ lại phần còn lại ở đầu hàng đợi
+                        self.outbox[0] = self.outbox[0][sent:]
+            finally:
+                self.tx_lock.release()
+        return True
+
+    def _send_batch(self) -> int:
+        """
+        Gửi các frame ở đầu hàng đợi bằng một lời gọi hệ thống duy nhất.
+        Phải được gọi khi đang giữ `tx_lock`.
+
+        Returns:
+            int: Số byte đã gửi.
+
+        Raises:
+            BlockingIOError: Nếu bộ đệm gửi của socket đang đầy.
+        """
+        if len(self.outbox) == 1 or not hasattr(self.socket, "sendmsg"):
+            return self.socket.send(self.outbox[0], NONBLOCKING_SEND_FLAGS)
+        # sendmsg() gom nhiều frame (scatter-gather) thay vì một send() cho mỗi frame
+        batch = list(islice(self.outbox, SEND_BATCH_FRAMES))
+        return self.socket.sendmsg(batch, (), NONBLOCKING_SEND_FLAGS)
 
     @property
     def peer_name(self):
@@ -35,10 +137,7 @@ class ChatClient:
         Trả về địa chỉ (IP, port) của client.
         Đây là một thuộc tính (property) chỉ đọc.
         """
-        try:
-            return self.socket.getpeername()
-        except OSError:
-            return "N/A (đã ngắt kết nối)"
+        return self.address
 
     def __eq__(self, value):
         """
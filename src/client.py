@@ -10,24 +10,33 @@ Trách nhiệm của nó bao gồm:
 - Xử lý việc mất kết nối và tự động kết nối lại (reconnect).
 """
 
+from collections import deque
 import time
+from typing import Deque
 from schemas import (
     AuthAction,
     AuthRequest,
     ChatMessage,
     GenericMessage,
+    INCOMING_MESSAGE_ADAPTER,
     MessageType,
     ServerResponse,
     ServerResponseType,
 )
 import socket
 import threading
-from configs import DEFAULT_BUFFER_SIZE, SERVER_HOST, SERVER_PORT, QUIT_COMMAND
-from utils import close_socket, get_user_credentials, request_user_login_register
-from queue import Queue
+from configs import SERVER_HOST, SERVER_PORT, QUIT_COMMAND
+from utils import (
+    close_socket,
+    get_user_credentials,
+    FrameReader,
+    recv_frame,
+    request_user_login_register,
+)
 
 MAX_RECONNECTION_ATTEMPTS = 3
 SLEEP_BETWEEN_RETRIES = 2  # seconds
+MESSAGE_BUFFER_LIMIT = 1024  # Số tin nhắn tối đa được giữ lại khi mất kết nối
 
 
 def attempt_reconnection(client_credentials):
@@ -82,21 +91,24 @@ def receive_messages(
         reconnect_event (threading.Event): Cờ hiệu báo cần kết nối lại.
     """
     should_reconnect = False
+    # Bộ đọc frame: một lần recv có thể chứa nhiều tin nhắn liên tiếp
+    frame_reader = FrameReader()
     while not stop_event.is_set():
         try:
-            # Receive message from the server
-            generic_message_bytes = client_socket.recv(DEFAULT_BUFFER_SIZE)
-            # If no data is received, the server has closed the connection
-            if not generic_message_bytes:
+            # Receive the next framed message from the server
+            generic_message_bytes = frame_reader.read_frame(client_socket)
+            # If no frame is received, the server has closed the connection
+            if generic_message_bytes is None:
                 should_reconnect = True
                 break
-            generic_msg = GenericMessage.model_validate_json(generic_message_bytes)
-            if generic_msg.type == MessageType.CHAT:
-                chat_msg = ChatMessage.model_validate(generic_msg.payload)
-                print(chat_msg.message_string)
-            elif generic_msg.type == MessageType.RESPONSE:
-                server_resp = ServerResponse.model_validate(generic_msg.payload)
-                print(server_resp.message_str)
+            # Phân tích và kiểm tra JSON một lần, payload đã đúng kiểu
+            incoming = INCOMING_MESSAGE_ADAPTER.validate_json(
+                bytes(generic_message_bytes)
+            )
+            if incoming.type == MessageType.CHAT:
+                print(incoming.payload.message_string)
+            else:
+                print(incoming.payload.message_str)
         except ConnectionResetError:
             print("Connection to the server was lost.")
             should_reconnect = True
@@ -112,6 +124,26 @@ def receive_messages(
         stop_event.set()
 
 
+def build_chat_frame(message_text: str, nickname: str) -> bytes:
+    """
+    Đóng gói một tin nhắn văn bản thành frame sẵn sàng gửi đến server.
+
+    Args:
+        message_text (str): Nội dung tin nhắn thô từ người dùng.
+        nickname (str): Tên người dùng hiện tại.
+
+    Returns:
+        bytes: Frame chứa GenericMessage loại CHAT.
+    """
+    # Tạo và đóng gói tin nhắn chat
+    chat_msg = ChatMessage(
+        sender=nickname, content=message_text, timestamp=int(time.time())
+    )
+    # Đóng gói tin nhắn chat vào GenericMessage
+    generic_msg = GenericMessage(type=MessageType.CHAT, payload=chat_msg.model_dump())
+    return generic_msg.encoded_bytes
+
+
 def send_message_text(message_text: str, client_socket: socket.socket, nickname: str):
     """
     Đóng gói và gửi một tin nhắn văn bản đến server.
@@ -122,17 +154,8 @@ def send_message_text(message_text: str, client_socket: socket.socket, nickname:
         nickname (str): Tên người dùng hiện tại.
     """
     if message_text:
-        # Tạo và đóng gói tin nhắn chat
-
-        chat_msg = ChatMessage(
-            sender=nickname, content=message_text, timestamp=int(time.time())
-        )
-        # Đóng gói tin nhắn chat vào GenericMessage
-        generic_msg = GenericMessage(
-            type=MessageType.CHAT, payload=chat_msg.model_dump()
-        )
         # Gửi tin nhắn đã đóng gói đến server
-        client_socket.send(generic_msg.encoded_bytes)
+        client_socket.sendall(build_chat_frame(message_text, nickname))
 
 
 def send_messages(
@@ -140,7 +163,7 @@ def send_messages(
     nickname: str,
     stop_event: threading.Event,
     reconnect_event: threading.Event,
-    message_buffer: Queue,
+    message_buffer: Deque[bytes],
 ):
     """
     Hàm chạy trong luồng chính, chuyên để lấy input từ người dùng
@@ -151,16 +174,18 @@ def send_messages(
         nickname (str): Tên người dùng.
         stop_event (threading.Event): Cờ hiệu để dừng luồng.
         reconnect_event (threading.Event): Cờ hiệu báo cần kết nối lại.
-        message_buffer (Queue): Hàng đợi để lưu tin nhắn khi mất kết nối.
+        message_buffer (Deque[bytes]): Hàng đợi các frame đã đóng gói, được giữ
+            lại khi mất kết nối.
     """
     should_reconnect = False
     while not stop_event.is_set():
         try:
             # --- Gửi tin nhắn trong bộ đệm (nếu có) ---
             # (Xảy ra sau khi kết nối lại thành công)
-            while not message_buffer.empty():
-                message_text = message_buffer.get()
-                send_message_text(message_text, client_socket, nickname)
+            # Các frame đã được đóng gói sẵn nên chỉ cần một lần gửi
+            if message_buffer:
+                client_socket.sendall(b"".join(message_buffer))
+                message_buffer.clear()
             # --- Nhận input từ người dùng ---
             message_text = input("> ")
 
@@ -170,7 +195,8 @@ def send_messages(
                 break
             # Nếu luồng nhận phát hiện mất kết nối
             if reconnect_event.is_set():
-                message_buffer.put(message_text)
+                if message_text:
+                    message_buffer.append(build_chat_frame(message_text, nickname))
                 break
             send_message_text(message_text, client_socket, nickname)
         except (EOFError, KeyboardInterrupt):
@@ -199,17 +225,22 @@ def create_connection() -> socket.socket:
     """
     try:
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    except OSError as e:
+        # Ví dụ: hết số file được mở (EMFILE)
+        print(f"Failed to create connection: {e}")
+        return None
+    try:
         client_socket.connect((SERVER_HOST, SERVER_PORT))
         return client_socket
     except KeyboardInterrupt:
         print("\nClient exiting...")
-        return None
     except ConnectionRefusedError:
         print("Connection failed. Is the server running?")
-        return None
     except Exception as e:
         print(f"Failed to create connection: {e}")
-        return None
+    # Kết nối thất bại: socket chưa từng kết nối nên chỉ cần đóng
+    close_socket(client_socket, is_connected=False)
+    return None
 
 
 def authenticate_with_server(
@@ -241,9 +272,9 @@ def authenticate_with_server(
     # Vòng lặp thử lại (dùng cho trường hợp mất kết nối khi đang xác thực)
     for attempt in range(1, MAX_RECONNECTION_ATTEMPTS + 1):
         try:
-            current_socket.send(auth_msg.encoded_bytes)
-            response_bytes = current_socket.recv(DEFAULT_BUFFER_SIZE)
-            if not response_bytes:
+            current_socket.sendall(auth_msg.encoded_bytes)
+            response_bytes = recv_frame(current_socket)
+            if response_bytes is None:
                 print("Server disconnected during authentication.")
                 raise ConnectionResetError("Server disconnected")
         except (ConnectionResetError, BrokenPipeError, OSError):
@@ -349,7 +380,9 @@ def start_chat_session(client_socket: socket.socket, client_credentials: dict):
         client_socket (socket.socket): Socket đã được xác thực.
         client_credentials (dict): Thông tin của người dùng.
     """
-    message_buffer = Queue()  # Hàng đợi lưu tin nhắn khi mất kết nối
+    # Hàng đợi có giới hạn lưu các frame chưa gửi được khi mất kết nối
+    # (khi đầy, tin nhắn cũ nhất bị bỏ)
+    message_buffer = deque(maxlen=MESSAGE_BUFFER_LIMIT)
 
     # Vòng lặp chính của phiên chat
     # Vòng lặp này sẽ lặp lại mỗi khi thực hiện kết nối lại
@@ -13,14 +13,39 @@ from pathlib import Path
 # Dùng print_local_ip.py để tìm IP này.
 SERVER_HOST = "127.0.0.1"  # Địa chỉ IP của server
 SERVER_PORT = 65432  # Cổng mà server sẽ lắng nghe
-DEFAULT_BUFFER_SIZE = 1024  # Kích thước bộ đệm (bytes) cho mỗi lần nhận dữ liệu
+RECV_BUFFER_SIZE = 65536  # Kích thước tối đa (bytes) của nội dung một frame
+# Kích thước bộ đệm nhận (bytes) cấp phát sẵn cho mỗi kết nối. Frame lớn hơn
+# sẽ mượn tạm một bộ đệm RECV_BUFFER_SIZE từ vùng dùng chung (pool).
+INITIAL_RECV_BUFFER_SIZE = 4096
 
 # --- Cài đặt phía Server ---
 # Lấy đường dẫn thư mục cha của thư mục chứa file này (dự án)
 CUR_DIR = Path(__file__).parent.parent.resolve()
 DB_PATH = CUR_DIR / "db"  # Đường dẫn đến thư mục cơ sở dữ liệu
-USERS_CSV = DB_PATH / "users.csv"  # Đường dẫn đến file CSV lưu trữ dữ liệu người dùng
+USERS_DB = DB_PATH / "users.db"  # Đường dẫn đến file SQLite lưu trữ dữ liệu người dùng
+# File CSV lưu người dùng của các phiên bản cũ, chỉ được đọc để nhập vào USERS_DB
+USERS_CSV = DB_PATH / "users.csv"
 SERVER_NAME = "SERVER"  # Tên định danh cho các tin nhắn từ server
+# Kích thước stack (bytes) cho mỗi luồng xác thực client. Mặc định của hệ điều hành
+# thường là 8MB, quá lớn cho một luồng chỉ chờ recv() và gửi tin nhắn ngắn.
+CLIENT_THREAD_STACK_SIZE = 512 * 1024
+# Số kết nối tối đa được phục vụ cùng lúc.
+# Kết nối vượt quá giới hạn này sẽ bị từ chối ngay.
+MAX_CONNECTIONS = 1000
+# Thời gian (giây) tối đa kể từ khi kết nối để client đăng nhập thành công.
+# Đây là hạn chót cho cả pha xác thực, không phải thời gian chờ mỗi lần recv:
+# kết nối chưa đăng nhập xong khi hết hạn sẽ bị đóng để giải phóng luồng xử lý.
+AUTH_TIMEOUT = 60
+# Số frame tối đa được xếp hàng chờ gửi cho một client. Vượt quá giới hạn này
+# nghĩa là client nhận quá chậm và sẽ bị ngắt kết nối.
+OUTBOX_LIMIT = 1024
+# Kích thước bộ đệm gửi của hệ điều hành (bytes) cho mỗi socket client, để
+# một đợt broadcast ít khi làm đầy bộ đệm và phải chờ gửi lại sau
+CLIENT_SNDBUF_SIZE = 256 * 1024
+# Số frame tối đa được gom vào một lần gọi sendmsg() (phải nhỏ hơn IOV_MAX)
+SEND_BATCH_FRAMES = 64
+# Số kết nối tối đa được xếp hàng chờ accept() (hệ điều hành có thể giới hạn thấp hơn)
+LISTEN_BACKLOG = 4096
 
 # --- Tiền tố lệnh ---
 PM_PREFIX = "/pm"  # Tiền tố cho tin nhắn riêng tư
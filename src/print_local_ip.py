@@ -7,22 +7,36 @@ và các máy khách (Client) khác trong cùng mạng LAN sẽ sử dụng
 để kết nối đến.
 """
 
+from functools import lru_cache
 import socket
 
 
+@lru_cache(maxsize=1)
 def get_local_ip():
     """
     Cố gắng xác định địa chỉ IP cục bộ của máy.
     Trả về '127.0.0.1' nếu thất bại.
 
-    Hàm này hoạt động bằng cách tạo một kết nối (ảo) đến một máy chủ
-    công cộng (như DNS của Google). Hệ điều hành sẽ tự động
+    Trước tiên hàm thử tra địa chỉ của chính tên máy (hostname). Nếu kết quả
+    là địa chỉ loopback (127.x.x.x) hoặc tra cứu thất bại, hàm tạo một kết nối
+    (ảo) đến một máy chủ công cộng (như DNS của Google). Hệ điều hành sẽ tự động
     chọn giao diện mạng (network interface) phù hợp để đi ra ngoài,
     và từ đó ta có thể lấy được địa chỉ IP cục bộ của giao diện đó.
 
+    Kết quả được ghi nhớ sau lần gọi đầu tiên; gọi
+    `get_local_ip.cache_clear()` nếu cấu hình mạng thay đổi.
+
     Returns:
         str: Địa chỉ IPV4 cục bộ của máy.
     """
+    # Cách nhanh: tên máy thường được ánh xạ sẵn tới IP LAN (/etc/hosts)
+    try:
+        IP = socket.gethostbyname(socket.gethostname())
+        if not IP.startswith("127."):
+            return IP
+    except OSError:
+        pass
+
     # Tạo một socket UDP (SOCK_DGRAM)
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
@@ -8,12 +8,74 @@ dữ liệu được trao đổi giữa Server và Client đều tuân theo mộ
 và tuần tự hóa (serialization) một cách dễ dàng.
 """
 
+from datetime import datetime
 from enum import Enum
-from pydantic import BaseModel
-import time
+from functools import cached_property
+from typing import Annotated, Literal, Tuple, Union
+from pydantic import BaseModel, Field, TypeAdapter
+import struct
 
 from configs import PM_PREFIX, SERVER_NAME
 
+# --- Định dạng khung (frame) trên đường truyền ---
+# Mỗi tin nhắn được gửi dưới dạng: [4 byte độ dài (big-endian)][nội dung JSON].
+# Nhờ đó bên nhận biết chính xác ranh giới giữa các tin nhắn trên luồng TCP.
+FRAME_HEADER = struct.Struct(">I")
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """
+    Thêm header độ dài vào trước dữ liệu để tạo thành một frame hoàn chỉnh.
+
+    Args:
+        payload (bytes): Nội dung tin nhắn (JSON đã mã hóa).
+
+    Returns:
+        bytes: Frame sẵn sàng để gửi qua socket.
+    """
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def dump_json_bytes(model: BaseModel) -> bytes:
+    """
+    Tuần tự hóa một mô hình Pydantic thẳng thành bytes JSON (UTF-8).
+    Bộ tuần tự hóa của lớp được dựng sẵn khi định nghĩa mô hình, nên cách này
+    bỏ qua bước tạo chuỗi `str` trung gian rồi `.encode()` của model_dump_json().
+
+    Args:
+        model (BaseModel): Mô hình cần tuần tự hóa.
+
+    Returns:
+        bytes: Nội dung JSON đã mã hóa.
+    """
+    return model.__pydantic_serializer__.to_json(model)
+
+
+# Giây (timestamp) được định dạng gần nhất cùng chuỗi kết quả. Các tin nhắn
+# gửi trong cùng một giây dùng lại chuỗi này thay vì định dạng lại từ đầu.
+# Lưu dưới dạng tuple để việc đọc/ghi từ nhiều luồng luôn nhất quán.
+_last_formatted_time: Tuple[int, str] = (-1, "")
+
+
+def format_timestamp(timestamp: int) -> str:
+    """
+    Chuyển Unix timestamp thành chuỗi giờ địa phương dạng 'YYYY-MM-DD HH:MM:SS'.
+
+    Args:
+        timestamp (int): Dấu thời gian (Unix timestamp).
+
+    Returns:
+        str: Chuỗi thời gian con người có thể đọc.
+    """
+    global _last_formatted_time
+    cached_second, cached_text = _last_formatted_time
+    if timestamp == cached_second:
+        return cached_text
+
+    text = datetime.fromtimestamp(timestamp).isoformat(sep=" ", timespec="seconds")
+    _last_formatted_time = (timestamp, text)
+    return text
+
 
 class MessageType(str, Enum):
     """
@@ -39,7 +101,7 @@ class ChatMessage(BaseModel):
     @property
     def encoded_bytes(self) -> bytes:
         """Chuyển đổi đối tượng tin nhắn thành chuỗi JSON và mã hóa sang bytes."""
-        return self.model_dump_json().encode("utf-8")
+        return dump_json_bytes(self)
 
     @property
     def message_string(self) -> str:
@@ -52,25 +114,43 @@ class ChatMessage(BaseModel):
             return f"[{self.sender}]: {self.content}"
 
         # Chuyển đổi timestamp thành định dạng con người có thể đọc
-        human_readable_time = time.strftime(
-            "%Y-%m-%d %H:%M:%S", time.localtime(self.timestamp)
-        )
+        human_readable_time = format_timestamp(self.timestamp)
 
         return f"[{human_readable_time}] {self.sender}: {self.content}"
 
+    @property
+    def log_string(self) -> str:
+        """
+        Trả về chuỗi tin nhắn dùng cho log của server, giữ nguyên Unix
+        timestamp thay vì định dạng lại thời gian cho mỗi tin nhắn chuyển tiếp.
+        """
+        return f"[{self.timestamp}] {self.sender}: {self.content}"
+
     @property
     def is_private(self) -> bool:
         """
         Kiểm tra xem tin nhắn này có phải là một tin nhắn riêng tư
         (được gửi bằng lệnh /pm) hay không.
-        Một tin nhắn riêng tư hợp lệ phải có 3 phần:
-        /pm <người_nhận> <nội_dung>
+        Chỉ kiểm tra tiền tố; việc tách và kiểm tra định dạng
+        /pm <người_nhận> <nội_dung> do server thực hiện.
         """
-        return (
-            self.content.startswith(PM_PREFIX) and len(self.content.split(" ", 2)) == 3
+        content = self.content
+        return content.startswith(PM_PREFIX) and (
+            len(content) == len(PM_PREFIX) or content[len(PM_PREFIX)] == " "
         )
 
 
+class ChatEnvelope(BaseModel):
+    """
+    GenericMessage loại CHAT với payload được khai báo sẵn là ChatMessage.
+    Server dùng mô hình này để kiểm tra tin nhắn chat chỉ trong một lần
+    phân tích JSON, thay vì phân tích GenericMessage rồi kiểm tra lại payload.
+    """
+
+    type: Literal[MessageType.CHAT]
+    payload: ChatMessage
+
+
 class GenericMessage(BaseModel):
     """
     Mô hình 'lồng' (wrapper) chung cho TẤT CẢ các tin nhắn
@@ -82,10 +162,15 @@ class GenericMessage(BaseModel):
     type: MessageType  # Loại tin nhắn (AUTH, CHAT, RESPONSE)
     payload: dict  # Dữ liệu thực sự (sẽ là một ChatMessage, AuthRequest, v.v.)
 
-    @property
+    @cached_property
     def encoded_bytes(self) -> bytes:
-        """Chuyển đổi toàn bộ đối tượng GenericMessage thành bytes."""
-        return self.model_dump_json().encode("utf-8")
+        """
+        Chuyển đổi toàn bộ đối tượng GenericMessage thành một frame
+        (header độ dài + JSON) sẵn sàng để gửi qua socket.
+        Kết quả được lưu lại sau lần gọi đầu tiên, nên việc gửi cùng
+        một tin nhắn nhiều lần không phải tuần tự hóa lại.
+        """
+        return encode_frame(dump_json_bytes(self))
 
 
 class AuthAction(str, Enum):
@@ -106,6 +191,17 @@ class AuthRequest(BaseModel):
     password: str
 
 
+class AuthEnvelope(BaseModel):
+    """
+    GenericMessage loại AUTH với payload được khai báo sẵn là AuthRequest.
+    Server dùng mô hình này để kiểm tra yêu cầu xác thực chỉ trong một lần
+    phân tích JSON, thay vì phân tích GenericMessage rồi kiểm tra lại payload.
+    """
+
+    type: Literal[MessageType.AUTH]
+    payload: AuthRequest
+
+
 class ServerResponseType(str, Enum):
     """Enum các loại phản hồi từ server."""
 
@@ -127,3 +223,20 @@ class ServerResponse(BaseModel):
     def message_str(self) -> str:
         """Trả về chuỗi phản hồi đã được định dạng để in ra client."""
         return "[SERVER] " + self.content
+
+
+class ResponseEnvelope(BaseModel):
+    """
+    GenericMessage loại RESPONSE với payload được khai báo sẵn là ServerResponse.
+    """
+
+    type: Literal[MessageType.RESPONSE]
+    payload: ServerResponse
+
+
+# Bộ giải mã tin nhắn server gửi đến client. Trường `type` được dùng làm
+# discriminator nên JSON chỉ được phân tích và kiểm tra đúng một lần,
+# trả về thẳng ChatEnvelope hoặc ResponseEnvelope với payload đã có kiểu.
+INCOMING_MESSAGE_ADAPTER: TypeAdapter = TypeAdapter(
+    Annotated[Union[ChatEnvelope, ResponseEnvelope], Field(discriminator="type")]
+)
@@ -3,72 +3,126 @@
 Trách nhiệm của nó bao gồm:
 - Khởi tạo và lắng nghe các kết nối socket đến.
 - Chấp nhận các client mới.
-- Xử lý mỗi client trong một luồng (thread) riêng biệt.
+- Xác thực mỗi client mới trong một luồng (thread) ngắn hạn riêng.
+- Phục vụ mọi client đã đăng nhập bằng một luồng đọc chung (selector),
+  cùng một luồng nền gửi tiếp dữ liệu cho các client có socket đang đầy.
 - Điều phối các giai đoạn: Xác thực (auth) và Trò chuyện (chat).
 - Quản lý trạng thái chung, bao gồm danh sách client và khóa (lock).
-- Đọc và ghi vào file CSV chứa dữ liệu người dùng.
+- Đọc và ghi dữ liệu người dùng qua UserStore (SQLite).
 """
 
-import json
-from typing import List
+from functools import lru_cache
+import selectors
+from typing import Dict, Optional, Tuple
 
 from pydantic import ValidationError
 from chat_client import ChatClient
 from configs import (
-    DB_PATH,
-    DEFAULT_BUFFER_SIZE,
+    AUTH_TIMEOUT,
+    CLIENT_SNDBUF_SIZE,
+    CLIENT_THREAD_STACK_SIZE,
+    LISTEN_BACKLOG,
+    MAX_CONNECTIONS,
+    PM_PREFIX,
     SERVER_PORT,
+    SHOW_USERS_COMMAND,
     SERVER_HOST,
     USERS_CSV,
+    USERS_DB,
     get_welcome_message,
 )
 import socket
 import threading
+import time
 from schemas import (
     AuthAction,
-    AuthRequest,
+    AuthEnvelope,
+    ChatEnvelope,
     ChatMessage,
     GenericMessage,
     MessageType,
     ServerResponse,
     ServerResponseType,
+    dump_json_bytes,
+    encode_frame,
 )
-from utils import add_new_user_to_db, verify_user_credentials, close_socket
-import pandas as pd
-import os
+from utils import UserStore, close_socket
 
 # --- State ---
-# List to keep track of all connected client sockets
-clients: List[ChatClient] = []
-# Lock to ensure that the clients list is accessed by only one thread at a time
+# Dict of all logged-in clients, keyed by username for O(1) lookups
+clients_by_name: Dict[str, ChatClient] = {}
+# Lock to ensure that the clients dict is accessed by only one thread at a time
 clients_lock = threading.Lock()
-csv_lock = threading.Lock()  # Lock for accessing the CSV file
-
-
-def load_users_df():
+# Immutable snapshot of clients_by_name.values(). It is replaced (never
+# mutated) under clients_lock whenever a client joins or leaves, so
+# broadcasts can iterate it without taking the lock at all
+active_clients: Tuple[ChatClient, ...] = ()
+# Serialized /users response, rebuilt only after the clients dict changes
+# (guarded by clients_lock, reset to None whenever a client joins or leaves)
+active_users_cache: Optional[bytes] = None
+# Registered users, loaded once at startup
+users = UserStore()
+# Selector watching clients whose socket buffer was full, so the rest of
+# their outbox is sent as soon as the socket becomes writable again
+pending_selector = selectors.DefaultSelector()
+pending_lock = threading.Lock()
+# Socket pair used to wake the flush thread up when a client starts pending
+pending_wakeup_reader, pending_wakeup_writer = socket.socketpair()
+pending_wakeup_reader.setblocking(False)
+pending_wakeup_writer.setblocking(False)
+# Selector watching every logged-in client for incoming data. A single
+# thread (serve_chat_clients) serves all of them instead of one thread each
+chat_selector = selectors.DefaultSelector()
+chat_lock = threading.Lock()
+# Socket pair used to wake the chat thread up when a client is added
+chat_wakeup_reader, chat_wakeup_writer = socket.socketpair()
+chat_wakeup_reader.setblocking(False)
+chat_wakeup_writer.setblocking(False)
+# Giới hạn số luồng xử lý client đang chạy cùng lúc
+connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+
+def build_response_bytes(status: ServerResponseType, content: str) -> bytes:
     """
-    Tải file CSV chứa thông tin người dùng vào một pandas DataFrame.
-    Nếu file không tồn tại, hàm sẽ tạo file và thư mục cần thiết.
+    Tạo frame (bytes) cho một phản hồi từ server.
+
+    Args:
+        status (ServerResponseType): Trạng thái phản hồi.
+        content (str): Nội dung phản hồi.
 
     Returns:
-        pd.DataFrame: DataFrame chứa dữ liệu người dùng.
+        bytes: Frame chứa GenericMessage loại RESPONSE, sẵn sàng để gửi.
     """
-    # Sử dụng khóa để đảm bảo chỉ một luồng được phép truy cập file CSV
-    # (ngăn chặn 2 luồng cùng đọc/ghi file một lúc)
-    with csv_lock:
-        if not os.path.exists(USERS_CSV):
-            os.makedirs(DB_PATH, exist_ok=True)
-            df = pd.DataFrame(columns=["username", "password"])
-            df.to_csv(USERS_CSV, index=False)
-            return df
-        return pd.read_csv(USERS_CSV)
+    response = ServerResponse(status=status, content=content)
+    return GenericMessage(
+        type=MessageType.RESPONSE, payload=response.model_dump()
+    ).encoded_bytes
 
 
-def save_users_df(df: pd.DataFrame):
-    """Lưu DataFrame trở lại file CSV."""
-    # Sử dụng khóa để đảm bảo chỉ một luồng được phép truy cập file CSV
-    with csv_lock:
-        df.to_csv(USERS_CSV, index=False)
+# --- Phản hồi xác thực dựng sẵn ---
+# Nội dung các phản hồi này không đổi, nên chỉ cần tuần tự hóa một lần
+# khi khởi động thay vì mỗi lần có yêu cầu xác thực
+REGISTER_OK_BYTES = build_response_bytes(
+    ServerResponseType.SUCCESS, "Registration successful. Please log in."
+)
+ERR_USER_EXISTS_BYTES = build_response_bytes(
+    ServerResponseType.ERROR, "Username already exists."
+)
+ERR_ALREADY_LOGGED_IN_BYTES = build_response_bytes(
+    ServerResponseType.ERROR, "This user is already logged in."
+)
+ERR_INVALID_CREDS_BYTES = build_response_bytes(
+    ServerResponseType.ERROR, "Invalid username or password."
+)
+ERR_BAD_AUTH_FORMAT_BYTES = build_response_bytes(
+    ServerResponseType.ERROR, "Invalid authentication request format."
+)
+ERR_SERVER_FULL_BYTES = build_response_bytes(
+    ServerResponseType.ERROR, "Server is full. Please try again later."
+)
+ERR_BAD_PM_FORMAT_BYTES = build_response_bytes(
+    ServerResponseType.ERROR, f"Usage: {PM_PREFIX} <username> <message>"
+)
 
 
 def create_server_socket():
@@ -85,8 +139,9 @@ def create_server_socket():
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     # Gắn socket vào địa chỉ và cổng đã định
     server_socket.bind((SERVER_HOST, SERVER_PORT))
-    # Bắt đầu lắng nghe kết nối đến
-    server_socket.listen()
+    # Bắt đầu lắng nghe kết nối đến, với hàng đợi đủ lớn để không
+    # từ chối kết nối khi nhiều client kết nối cùng lúc
+    server_socket.listen(LISTEN_BACKLOG)
     print(f"[INFO] Server đang lắng nghe trên {SERVER_HOST}:{SERVER_PORT}")
     return server_socket
 
@@ -100,17 +155,119 @@ def send_generic_message_bytes(generic_msg_bytes: bytes, client: ChatClient):
         generic_msg_bytes (bytes): Dữ liệu tin nhắn đã được mã hóa.
         client (ChatClient): Đối tượng client người nhận.
     """
+    if client.dead:
+        return  # Kết nối đã hỏng, đang chờ được dọn dẹp
     try:
-        client.socket.send(generic_msg_bytes)
+        # Gửi không chờ: nếu bộ đệm gửi của client đầy, phần còn lại nằm trong
+        # hàng đợi của client và được luồng nền gửi tiếp, luồng hiện tại
+        # không bị một client chậm chặn lại
+        if not client.queue_frame(generic_msg_bytes):
+            watch_pending(client)
     except Exception as e:
         # Xử lý lỗi gửi tin nhắn
         print(f"Failed to send message to {client.username}. Error: {e}")
-        # Loại bỏ client khỏi danh sách nếu không thể gửi tin nhắn
-        close_socket(client.socket)
-        # Loại bỏ client khỏi danh sách clients
-        with clients_lock:
-            if client in clients:
-                clients.remove(client)
+        abort_client(client)
+
+
+def abort_client(client: ChatClient):
+    """
+    Ngắt kết nối một client sau khi gửi thất bại. Client chỉ được đánh dấu
+    là đã hỏng (không cần giữ clients_lock) và socket bị shutdown (không đóng):
+    luồng đang đọc từ client sẽ nhận EOF và tự dọn dẹp (disconnect_client)
+    đúng một lần. Trong lúc chờ, các tin nhắn gửi đến client này bị bỏ qua.
+
+    Args:
+        client (ChatClient): Client cần ngắt kết nối.
+    """
+    client.dead = True
+    unwatch_pending(client)
+    try:
+        client.socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Socket đã bị ngắt từ trước
+
+
+def watch_pending(client: ChatClient):
+    """
+    Đăng ký theo dõi một client còn dữ liệu chờ gửi, để luồng nền
+    gửi tiếp khi socket của client sẵn sàng.
+
+    Args:
+        client (ChatClient): Client có hàng đợi gửi chưa trống.
+    """
+    with pending_lock:
+        # Không theo dõi lại client đã đóng: số fd của nó có thể đã được
+        # hệ điều hành cấp lại cho một kết nối mới
+        if client.closed or client.socket.fileno() == -1:
+            return
+        try:
+            pending_selector.register(client.socket, selectors.EVENT_WRITE, client)
+        except KeyError:
+            return  # Client đã được theo dõi
+    # Đánh thức luồng nền để nó theo dõi cả socket vừa đăng ký
+    try:
+        pending_wakeup_writer.send(b"\0")
+    except BlockingIOError:
+        pass  # Luồng nền đã có tín hiệu đánh thức đang chờ
+
+
+def unwatch_pending(client: ChatClient, only_if_idle: bool = False):
+    """
+    Ngừng theo dõi một client (phải gọi trước khi đóng socket của client).
+
+    Args:
+        client (ChatClient): Client cần ngừng theo dõi.
+        only_if_idle (bool): Chỉ ngừng theo dõi nếu hàng đợi gửi của client
+            đã trống (kiểm tra dưới khóa, để không bỏ sót frame vừa được thêm).
+    """
+    with pending_lock:
+        if only_if_idle and client.outbox:
+            return
+        try:
+            pending_selector.unregister(client.socket)
+        except (KeyError, ValueError):
+            pass  # Client không được theo dõi
+
+
+def flush_pending_clients():
+    """
+    Vòng lặp của luồng nền: chờ các socket đang đầy sẵn sàng ghi trở lại,
+    rồi gửi tiếp phần dữ liệu còn trong hàng đợi của client.
+    """
+    with pending_lock:
+        pending_selector.register(pending_wakeup_reader, selectors.EVENT_READ, None)
+    while True:
+        for key, _ in pending_selector.select():
+            client = key.data
+            if client is None:
+                # Tín hiệu đánh thức: bỏ dữ liệu đi, danh sách socket đã cập nhật
+                try:
+                    pending_wakeup_reader.recv(4096)
+                except BlockingIOError:
+                    pass
+                continue
+            try:
+                if client.flush():
+                    unwatch_pending(client, only_if_idle=True)
+            except OSError as e:
+                print(f"Failed to send message to {client.username}. Error: {e}")
+                abort_client(client)
+
+
+def remove_client(client: ChatClient):
+    """
+    Loại bỏ một client khỏi danh sách client đang hoạt động (nếu có).
+    Chỉ xóa khi username vẫn đang trỏ tới chính client này.
+
+    Args:
+        client (ChatClient): Client cần loại bỏ.
+    """
+    global active_clients, active_users_cache
+    with clients_lock:
+        if clients_by_name.get(client.username) is client:
+            del clients_by_name[client.username]
+            active_clients = tuple(clients_by_name.values())
+            active_users_cache = None
 
 
 def broadcast(message_bytes: bytes, sending_client: ChatClient):
@@ -122,11 +279,12 @@ def broadcast(message_bytes: bytes, sending_client: ChatClient):
         message_bytes (bytes): Dữ liệu tin nhắn cần gửi.
         sending_client (ChatClient): Client gốc đã gửi tin nhắn.
     """
-    # Sử dụng khóa để đảm bảo truy cập an toàn vào danh sách clients
-    with clients_lock:
-        for client in clients:
-            if client != sending_client:
-                send_generic_message_bytes(message_bytes, client)
+    # Duyệt bản chụp (snapshot) bất biến của danh sách client, không cần khóa.
+    # Việc gửi diễn ra bên ngoài khóa để một client chậm không chặn
+    # các luồng khác
+    for client in active_clients:
+        if client is not sending_client and not client.dead:
+            send_generic_message_bytes(message_bytes, client)
 
 
 def handle_private_message(chat_message: ChatMessage, sending_client: ChatClient):
@@ -138,32 +296,36 @@ def handle_private_message(chat_message: ChatMessage, sending_client: ChatClient
         chat_message (ChatMessage): Đối tượng tin nhắn chat đã được phân tích.
         sending_client (ChatClient): Client đã gửi tin nhắn riêng.
     """
-    _, recipient, content = chat_message.content.split(" ", 2)
+    # Tách "/pm <recipient> <content>" bằng hai lần find, không tạo list trung gian
+    text = chat_message.content
+    i = text.find(" ")
+    j = text.find(" ", i + 1) if i != -1 else -1
+    if j == -1:
+        send_generic_message_bytes(ERR_BAD_PM_FORMAT_BYTES, sending_client)
+        return
+    recipient = text[i + 1 : j]
+    content = text[j + 1 :]
+    # Tra cứu O(1) theo username; việc gửi diễn ra bên ngoài khóa
     with clients_lock:
-        recipient_client = next((c for c in clients if c.username == recipient), None)
-        if recipient_client:
-            private_msg = ChatMessage(
-                sender=chat_message.sender,
-                content=f"(private) {content}",
-                timestamp=chat_message.timestamp,
+        recipient_client = clients_by_name.get(recipient)
+    if recipient_client:
+        if recipient_client is not sending_client:
+            # Chỉ nội dung thay đổi: sao chép tin nhắn đã kiểm tra và tuần tự hóa
+            # một lần, không qua dict trung gian và không kiểm tra lại payload
+            private_msg = chat_message.model_copy(
+                update={"content": f"(private) {content}"}
             )
-            private_generic_msg = GenericMessage(
-                type=MessageType.CHAT, payload=private_msg.model_dump()
+            private_envelope = ChatEnvelope(type=MessageType.CHAT, payload=private_msg)
+            send_generic_message_bytes(
+                encode_frame(dump_json_bytes(private_envelope)),
+                recipient_client,
             )
-            if recipient_client != sending_client:
-                send_generic_message_bytes(
-                    private_generic_msg.encoded_bytes, recipient_client
-                )
-        else:
-            # Gửi phản hồi lỗi trở lại client gửi tin nhắn
-            error_response = ServerResponse(
-                status=ServerResponseType.ERROR,
-                content=f"User '{recipient}' not found or not online.",
-            )
-            error_generic_msg = GenericMessage(
-                type=MessageType.RESPONSE, payload=error_response.model_dump()
-            )
-            send_generic_message_bytes(error_generic_msg.encoded_bytes, sending_client)
+    else:
+        # Gửi phản hồi lỗi trở lại client gửi tin nhắn
+        error_bytes = build_response_bytes(
+            ServerResponseType.ERROR, f"User '{recipient}' not found or not online."
+        )
+        send_generic_message_bytes(error_bytes, sending_client)
 
 
 def handle_get_active_users(sending_client: ChatClient) -> None:
@@ -174,92 +336,226 @@ def handle_get_active_users(sending_client: ChatClient) -> None:
     Args:
         sending_client (ChatClient): Client đã gõ lệnh /users.
     """
+    global active_users_cache
     with clients_lock:
-        active_usernames = [client.username for client in clients if client.username]
-    users_list = "\n".join(active_usernames) if active_usernames else "No users online."
-    server_response = ServerResponse(
-        status=ServerResponseType.SUCCESS,
-        content=f"Active users:\n{users_list}",
-    )
-    server_response_msg = GenericMessage(
-        type=MessageType.RESPONSE, payload=server_response.model_dump()
-    )
+        # Chỉ tạo lại phản hồi khi danh sách client đã thay đổi
+        if active_users_cache is None:
+            users_list = (
+                "\n".join(clients_by_name) if clients_by_name else "No users online."
+            )
+            active_users_cache = build_response_bytes(
+                ServerResponseType.SUCCESS, f"Active users:\n{users_list}"
+            )
+        response_bytes = active_users_cache
     # Gửi danh sách người dùng trở lại client yêu cầu
-    send_generic_message_bytes(server_response_msg.encoded_bytes, sending_client)
+    send_generic_message_bytes(response_bytes, sending_client)
 
 
 def handle_chat_message(
-    generic_msg: GenericMessage, sending_client: ChatClient
+    chat_message: ChatMessage, sending_client: ChatClient, message_bytes: bytes
 ) -> None:
     """
     Phân tích và xử lý một tin nhắn CHAT đến.
     Hàm này quyết định tin nhắn là riêng tư, lệnh, hay công khai.
 
     Args:
-        generic_msg (GenericMessage): Đối tượng tin nhắn chung.
+        chat_message (ChatMessage): Tin nhắn chat đã được kiểm tra.
         sending_client (ChatClient): Client đã gửi tin nhắn.
+        message_bytes (bytes): Nội dung JSON gốc nhận được từ socket. Tin nhắn
+            công khai được chuyển tiếp nguyên vẹn, không cần tuần tự hóa lại.
     """
-    chat_message = ChatMessage.model_validate(generic_msg.payload)
-    print(chat_message.message_string)
-    # Xử lý tin nhắn dựa trên loại
-    if chat_message.is_private:
-        # Tin nhắn riêng tư
-        handle_private_message(chat_message, sending_client)
-    elif chat_message.content.strip() == "/users":
-        # Lệnh hiển thị người dùng đang hoạt động
-        handle_get_active_users(sending_client)
-    else:
-        # Tin nhắn công khai - phát sóng đến tất cả client khác
-        broadcast(generic_msg.encoded_bytes, sending_client)
+    print(chat_message.log_string)
+    # Mọi lệnh đều bắt đầu bằng "/": tin nhắn thường (không chứa "/") được
+    # phát sóng ngay mà không cần nhận diện lệnh
+    if "/" in chat_message.content:
+        # Xử lý tin nhắn dựa trên loại
+        if chat_message.is_private:
+            # Tin nhắn riêng tư
+            handle_private_message(chat_message, sending_client)
+            return
+        if chat_message.content.strip() == SHOW_USERS_COMMAND:
+            # Lệnh hiển thị người dùng đang hoạt động
+            handle_get_active_users(sending_client)
+            return
+    # Tin nhắn công khai - phát sóng đến tất cả client khác
+    broadcast(encode_frame(message_bytes), sending_client)
 
 
-def handle_chat(client: ChatClient):
+def handle_chat_frames(client: ChatClient):
     """
-    Vòng lặp chính xử lý các tin nhắn CHAT từ một client
-    (sau khi đã xác thực thành công).
+    Xử lý mọi tin nhắn CHAT hoàn chỉnh đang có trong bộ đệm nhận của client.
 
     Args:
         client (ChatClient): Client đang trong phiên chat.
+
+    Raises:
+        ValidationError: Nếu client gửi một tin nhắn không hợp lệ.
     """
     while True:
-        try:
-            # Chờ nhận tin nhắn từ client
-            generic_message_bytes = client.socket.recv(DEFAULT_BUFFER_SIZE)
+        data = client.reader.next_frame()
+        if data is None:
+            return
+        message_bytes = bytes(data)
+        # Kiểm tra cả lớp bọc lẫn payload ChatMessage trong một lần phân tích
+        chat_message = ChatEnvelope.model_validate_json(message_bytes).payload
+        handle_chat_message(chat_message, client, message_bytes)
 
-            # Nếu nhận được bytes rỗng, client đã đóng kết nối
-            if not generic_message_bytes:
-                print(f"Finished handling chat {client.peer_name}.")
-                break
 
-            generic_msg = GenericMessage.model_validate_json(generic_message_bytes)
-            if generic_msg.type == MessageType.CHAT:
-                handle_chat_message(generic_msg, client)
+def read_chat_client(client: ChatClient) -> bool:
+    """
+    Nhận dữ liệu từ một client đã đăng nhập (khi socket sẵn sàng đọc)
+    và xử lý các tin nhắn hoàn chỉnh.
 
-        except ConnectionResetError:
-            # Handle the case where the client forcefully closes the connection
-            print(f"{client.peer_name} disconnected unexpectedly.")
-            break
-        except Exception as e:
-            print(f"[ERROR] {e}")
-            break
+    Args:
+        client (ChatClient): Client đang trong phiên chat.
 
-    # Khi vòng lặp kết thúc, thông báo rằng người dùng đã offline
-    notice_user_presence(client.username, online=False)
+    Returns:
+        bool: False nếu client đã ngắt kết nối hoặc gặp lỗi, True nếu ngược lại.
+    """
+    try:
+        # Nhận thẳng vào bộ đệm của client; selector đã báo có dữ liệu
+        # nên lời gọi recv này không phải chờ
+        if not client.reader.fill(client.socket):
+            # Client đã đóng kết nối
+            print(f"Finished handling chat {client.peer_name}.")
+            return False
+        handle_chat_frames(client)
+        return True
+    except BlockingIOError:
+        # Selector báo sẵn sàng nhưng chưa có dữ liệu để đọc
+        return True
+    except ConnectionResetError:
+        # Handle the case where the client forcefully closes the connection
+        print(f"{client.peer_name} disconnected unexpectedly.")
+    except (ValidationError, ValueError) as e:
+        # Frame sai định dạng hoặc quá lớn: client hỏng, đóng ngay (RST)
+        print(f"[ERROR] Bad frame from {client.peer_name}: {e}")
+        client.dead = True
+    except Exception as e:
+        print(f"[ERROR] {e}")
+    return False
+
+
+def watch_chat(client: ChatClient):
+    """
+    Giao một client vừa đăng nhập cho luồng đọc chung.
+
+    Args:
+        client (ChatClient): Client đã xác thực thành công.
+    """
+    with chat_lock:
+        chat_selector.register(client.socket, selectors.EVENT_READ, client)
+    # Đánh thức luồng đọc chung để nó theo dõi cả socket vừa đăng ký
+    try:
+        chat_wakeup_writer.send(b"\0")
+    except BlockingIOError:
+        pass  # Luồng đọc đã có tín hiệu đánh thức đang chờ
+
+
+def unwatch_chat(client: ChatClient):
+    """
+    Ngừng theo dõi dữ liệu đến từ một client (phải gọi trước khi đóng socket).
+
+    Args:
+        client (ChatClient): Client cần ngừng theo dõi.
+    """
+    with chat_lock:
+        try:
+            chat_selector.unregister(client.socket)
+        except (KeyError, ValueError):
+            pass  # Client không được theo dõi
 
 
-def is_username_active(username: str) -> bool:
+def serve_chat_clients():
     """
-    Kiểm tra xem username đã được sử dụng bởi một client
-    đang hoạt động (đã đăng nhập) hay chưa.
+    Vòng lặp của luồng đọc chung: một luồng duy nhất chờ dữ liệu từ mọi
+    client đã đăng nhập và xử lý tin nhắn khi có dữ liệu đến, thay vì mỗi
+    client giữ một luồng chỉ để chờ recv().
+    """
+    with chat_lock:
+        chat_selector.register(chat_wakeup_reader, selectors.EVENT_READ, None)
+    while True:
+        for key, _ in chat_selector.select():
+            client = key.data
+            if client is None:
+                # Tín hiệu đánh thức: bỏ dữ liệu đi, danh sách socket đã cập nhật
+                try:
+                    chat_wakeup_reader.recv(4096)
+                except BlockingIOError:
+                    pass
+                continue
+            if not read_chat_client(client):
+                unwatch_chat(client)
+                disconnect_client(client)
+
+
+def disconnect_client(client: ChatClient):
+    """
+    Dọn dẹp một kết nối đã kết thúc (lỗi, /quit, mất kết nối, xác thực thất bại):
+    thông báo người dùng offline, loại bỏ client và đóng socket.
+    Phải được gọi đúng một lần cho mỗi kết nối.
 
     Args:
-        username (str): Tên người dùng cần kiểm tra.
+        client (ChatClient): Client cần dọn dẹp.
+    """
+    if client.username is not None:
+        # Thông báo rằng người dùng đã offline
+        notice_user_presence(client.username, online=False)
+    print(f"[DISCONNECTED] Disconnected {client.peer_name}.")
+    remove_client(client)
+    # Đánh dấu đã đóng dưới pending_lock trước khi ngừng theo dõi, để luồng
+    # khác không thể đăng ký lại socket sắp bị đóng vào pending_selector
+    with pending_lock:
+        client.closed = True
+    unwatch_pending(client)
+    # Kết nối đã hỏng thì đóng ngay (RST), không chờ kết thúc bình thường
+    close_socket(client.socket, force=client.dead)
+    connection_slots.release()
+
+
+def try_register_active(username: str, client: ChatClient) -> bool:
+    """
+    Đánh dấu client là đã đăng nhập với username đã cho, nếu username
+    chưa được một client nào khác sử dụng. Việc kiểm tra và thêm vào
+    danh sách diễn ra trong cùng một lần giữ khóa, nên hai lần đăng nhập
+    đồng thời cùng một tài khoản không thể cùng thành công.
+
+    Args:
+        username (str): Tên người dùng vừa xác thực thành công.
+        client (ChatClient): Client tương ứng.
 
     Returns:
-        bool: True nếu username đã được sử dụng, False nếu chưa.
+        bool: True nếu đã đăng ký thành công, False nếu username đang được sử dụng.
     """
+    global active_clients, active_users_cache
     with clients_lock:
-        return any(client.username == username for client in clients)
+        if username in clients_by_name:
+            return False
+        client.username = username
+        clients_by_name[username] = client
+        active_clients = tuple(clients_by_name.values())
+        active_users_cache = None
+    return True
+
+
+@lru_cache(maxsize=1024)
+def make_presence_frame(username: str, online: bool) -> bytes:
+    """
+    Tạo frame thông báo trạng thái (online/offline) của một người dùng.
+    Kết quả được ghi nhớ theo (username, online), nên người dùng kết nối
+    lại nhiều lần không phải tuần tự hóa lại thông báo.
+
+    Args:
+        username (str): Tên người dùng đã thay đổi trạng thái.
+        online (bool): True nếu vừa online, False nếu vừa offline.
+
+    Returns:
+        bytes: Frame thông báo sẵn sàng để gửi.
+    """
+    status = "online" if online else "offline"
+    return build_response_bytes(
+        ServerResponseType.INFO, f"User '{username}' is now {status}."
+    )
 
 
 def notice_user_presence(username: str, online: bool):
@@ -271,112 +567,123 @@ def notice_user_presence(username: str, online: bool):
         username (str): Tên người dùng đã thay đổi trạng thái.
         online (bool): True nếu vừa online, False nếu vừa offline.
     """
-    status = "online" if online else "offline"
-    notification = ServerResponse(
-        status=ServerResponseType.INFO,
-        content=f"User '{username}' is now {status}.",
-    )
-    notification_msg = GenericMessage(
-        type=MessageType.RESPONSE, payload=notification.model_dump()
-    )
-    with clients_lock:
-        for client in clients:
-            if client.username != username:
-                send_generic_message_bytes(notification_msg.encoded_bytes, client)
+    # Mã hóa tin nhắn một lần duy nhất cho tất cả người nhận
+    notification_bytes = make_presence_frame(username, online)
+    for client in active_clients:
+        if client.username != username:
+            send_generic_message_bytes(notification_bytes, client)
 
 
-def handle_auth(client: ChatClient):
+def receive_before(client: ChatClient, deadline: float) -> Optional[memoryview]:
+    """
+    Nhận frame tiếp theo từ client, nhưng không chờ quá thời điểm `deadline`.
+    Thời gian chờ của socket được đặt lại theo thời gian còn lại trước mỗi
+    lần recv, nên client gửi nhỏ giọt từng byte cũng không kéo dài được hạn.
+
+    Args:
+        client (ChatClient): Client đang xác thực.
+        deadline (float): Thời điểm (theo time.monotonic()) phải nhận xong frame.
+
+    Returns:
+        memoryview: Nội dung (JSON) của frame.
+        None: Nếu client đã đóng kết nối.
+
+    Raises:
+        socket.timeout: Nếu đã quá hạn mà chưa nhận đủ một frame.
+    """
+    while True:
+        frame = client.reader.next_frame()
+        if frame is not None:
+            return frame
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("Authentication deadline passed.")
+        client.socket.settimeout(remaining)
+        if not client.reader.fill(client.socket):
+            return None
+
+
+def handle_auth(client: ChatClient, deadline: float):
     """
     Xử lý pha xác thực (Đăng nhập/Đăng ký) cho một client mới.
-    Vòng lặp này chạy cho đến khi client xác thực thành công hoặc
-    ngắt kết nối.
+    Vòng lặp này chạy cho đến khi client xác thực thành công,
+    ngắt kết nối hoặc hết hạn xác thực.
 
     Args:
         client (ChatClient): Client mới kết nối, chưa xác thực.
+        deadline (float): Thời điểm (theo time.monotonic()) client phải
+            đăng nhập xong.
 
     Returns:
         str: Tên người dùng (username) nếu xác thực thành công.
         None: Nếu client ngắt kết nối trước khi xác thực.
     """
-    username = None
     while True:
-        # Chờ nhận yêu cầu xác thực từ client
-        auth_bytes = client.socket.recv(DEFAULT_BUFFER_SIZE)
-        if not auth_bytes:
+        # Chờ nhận yêu cầu xác thực từ client (không quá hạn xác thực)
+        try:
+            data = receive_before(client, deadline)
+        except socket.timeout:
+            print(f"{client.peer_name} timed out during authentication.")
+            client.dead = True
+            return None
+        if data is None:
             return  # Client đã ngắt kết nối
 
         try:
-            generic_msg = GenericMessage.model_validate_json(auth_bytes)
-            if generic_msg.type != MessageType.AUTH:
-                continue  # Bỏ qua nếu không phải tin nhắn AUTH
-
-            auth_req = AuthRequest.model_validate(generic_msg.payload)
-            users_df = load_users_df()
+            # Kiểm tra cả lớp bọc lẫn payload trong một lần phân tích JSON.
+            # Tin nhắn không phải AUTH cũng bị coi là yêu cầu sai định dạng.
+            auth_req = AuthEnvelope.model_validate_json(bytes(data)).payload
 
             # Xử lý yêu cầu đăng ký
             if auth_req.action == AuthAction.REGISTER:
-                # Kiểm tra nếu username đã tồn tại
-                if auth_req.username in users_df["username"].values:
-                    response = ServerResponse(
-                        status=ServerResponseType.ERROR,
-                        content="Username already exists.",
-                    )
+                # Đăng ký thất bại nếu username đã tồn tại
+                if users.add_new_user_to_db(auth_req.username, auth_req.password):
+                    response_bytes = REGISTER_OK_BYTES
                 else:
-                    users_df = add_new_user_to_db(
-                        users_df, auth_req.username, auth_req.password
-                    )
-                    save_users_df(users_df)
-                    response = ServerResponse(
-                        status=ServerResponseType.SUCCESS,
-                        content="Registration successful. Please log in.",
-                    )
+                    response_bytes = ERR_USER_EXISTS_BYTES
             # Xử lý yêu cầu đăng nhập
             elif auth_req.action == AuthAction.LOGIN:
-                if verify_user_credentials(
-                    users_df, auth_req.username, auth_req.password
-                ) and not is_username_active(auth_req.username):
-                    response = ServerResponse(
-                        status=ServerResponseType.SUCCESS,
-                        content=get_welcome_message(auth_req.username),
-                    )
-                    username = auth_req.username
-                elif is_username_active(auth_req.username):
-                    response = ServerResponse(
-                        status=ServerResponseType.ERROR,
-                        content="This user is already logged in.",
-                    )
+                if not users.verify_user_credentials(
+                    auth_req.username, auth_req.password
+                ):
+                    response_bytes = ERR_INVALID_CREDS_BYTES
                 else:
-                    response = ServerResponse(
-                        status=ServerResponseType.ERROR,
-                        content="Invalid username or password.",
+                    # Tin nhắn chào mừng chứa username nên phải tạo cho từng lần.
+                    # Nó được xếp vào hàng đợi trước khi client xuất hiện trong
+                    # danh sách, để luôn là frame đầu tiên client nhận được.
+                    client.outbox.append(
+                        build_response_bytes(
+                            ServerResponseType.SUCCESS,
+                            get_welcome_message(auth_req.username),
+                        )
                     )
+                    # Hết giai đoạn xác thực: socket chuyển sang chế độ không chặn
+                    # trước khi các luồng khác có thể gửi dữ liệu cho client này.
+                    # Mọi lần gửi/nhận sau đó chạy trên luồng chung, nên không
+                    # được phép chờ một client chậm (kể cả trên Windows, nơi
+                    # không có cờ MSG_DONTWAIT).
+                    client.socket.setblocking(False)
+                    if try_register_active(auth_req.username, client):
+                        if not client.flush():
+                            watch_pending(client)
+                        notice_user_presence(auth_req.username, online=True)
+                        return auth_req.username
+                    client.outbox.clear()
+                    # Vẫn đang xác thực: gửi phản hồi lỗi với thời gian chờ có giới hạn
+                    client.socket.settimeout(AUTH_TIMEOUT)
+                    response_bytes = ERR_ALREADY_LOGGED_IN_BYTES
             # Send response back to client
-            response_msg = GenericMessage(
-                type=MessageType.RESPONSE, payload=response.model_dump()
-            )
-            client.socket.send(response_msg.encoded_bytes)
-
-            if (
-                response.status == ServerResponseType.SUCCESS
-                and auth_req.action == AuthAction.LOGIN
-            ):
-                notice_user_presence(username, online=True)
-                return username
-        except (ValidationError, json.JSONDecodeError):
-            response = ServerResponse(
-                status=ServerResponseType.ERROR,
-                content="Invalid authentication request format.",
-            )
-            response_msg = GenericMessage(
-                type=MessageType.RESPONSE, payload=response.model_dump()
-            )
-            client.socket.send(response_msg.encoded_bytes)
+            client.socket.sendall(response_bytes)
+        except ValidationError:
+            # Pydantic báo cả lỗi JSON không hợp lệ dưới dạng ValidationError
+            client.socket.sendall(ERR_BAD_AUTH_FORMAT_BYTES)
 
 
 def handle_client(client: ChatClient):
     """
-    Hàm xử lý chính cho mỗi client, chạy trong một luồng riêng.
-    Điều phối qua 2 giai đoạn: Xác thực và Chat.
+    Hàm xử lý pha xác thực cho mỗi client, chạy trong một luồng riêng.
+    Sau khi đăng nhập thành công, client được giao cho luồng đọc chung
+    (serve_chat_clients) và luồng này kết thúc.
 
     Args:
         client (ChatClient): Đối tượng client mới được chấp nhận.
@@ -384,30 +691,33 @@ def handle_client(client: ChatClient):
     peer_name = client.peer_name
     print(f"[NEW CONNECTION] {peer_name} connected.")
 
-    username = None
     try:
         # --- Giai đoạn 1: Xác thực ---
-        # Vòng lặp này sẽ block cho đến khi xác thực thành công hoặc thất bại
-        username = handle_auth(client)
+        # Vòng lặp này sẽ block cho đến khi xác thực thành công hoặc thất bại.
+        # Client phải đăng nhập xong trong AUTH_TIMEOUT giây kể từ khi kết nối
+        # (dù vẫn gửi dữ liệu), để không giữ luồng và chỗ kết nối vô ích.
+        deadline = time.monotonic() + AUTH_TIMEOUT
+        username = handle_auth(client, deadline)
         if username is None:
             print(f"{peer_name} failed to authenticate.")
+            disconnect_client(client)
             return
         # --- Giai đoạn 2: Chat ---
+        # (client đã được thêm vào danh sách trong handle_auth)
         print(f"[{username}] has successfully logged in.")
-        client.username = username
-        with clients_lock:
-            clients.append(client)
-        handle_chat(client)
-
-    finally:
-        # --- Giai đoạn 3: Dọn dẹp ---
-        # Bất kể luồng kết thúc như thế nào (lỗi, /quit, mất kết nối),
-        # phần này luôn chạy
-        print(f"[DISCONNECTED] Disconnected {peer_name}.")
-        with clients_lock:
-            if client in clients:
-                clients.remove(client)
-        close_socket(client.socket)
+        # Tin nhắn có thể đã đến cùng lúc với yêu cầu đăng nhập
+        handle_chat_frames(client)
+    except (ValidationError, ValueError) as e:
+        # Frame sai định dạng hoặc quá lớn: client hỏng, đóng ngay (RST)
+        print(f"[ERROR] Bad frame from {peer_name}: {e}")
+        client.dead = True
+        disconnect_client(client)
+        return
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        disconnect_client(client)
+        return
+    watch_chat(client)
 
 
 def run():
@@ -415,8 +725,15 @@ def run():
     Hàm `run` chính của server.
     Khởi tạo, tải dữ liệu và bắt đầu vòng lặp chấp nhận client.
     """
-    # Tải (hoặc tạo) file users.csv khi server khởi động
-    load_users_df()
+    # Tải (hoặc tạo) cơ sở dữ liệu người dùng một lần duy nhất khi server khởi động
+    users.load(USERS_DB, USERS_CSV)
+    # Giảm stack của các luồng tạo ra sau lời gọi này, để mỗi client
+    # đang xác thực (phần lớn thời gian chỉ ngồi chờ) tốn ít bộ nhớ hơn
+    threading.stack_size(CLIENT_THREAD_STACK_SIZE)
+    # Luồng nền gửi tiếp dữ liệu cho các client có socket đang đầy
+    threading.Thread(target=flush_pending_clients, daemon=True).start()
+    # Luồng đọc chung nhận và xử lý tin nhắn của mọi client đã đăng nhập
+    threading.Thread(target=serve_chat_clients, daemon=True).start()
     try:
         # Tạo socket lăng nghe kết nối đến
         server_socket = create_server_socket()
@@ -428,19 +745,41 @@ def run():
         try:
             # Chấp nhận một kết nối mới (đây là hàm blocking)
             client_socket, _ = server_socket.accept()
-            # Tạo đối tượng ChatClient để quản lý client này
-            chat_client = ChatClient(socket=client_socket)
-            # Tạo một luồng mới để xử lý client này
-            # Điều này cho phép server xử lý nhiều client cùng lúc
-            thread = threading.Thread(target=handle_client, args=(chat_client,))
-            thread.daemon = (
-                True  # Đặt là daemon để chương trình chính có thể thoát
-                # ngay cả khi các luồng con đang chạy
-            )
-            thread.start()
+            # Từ chối ngay nếu đã đủ số kết nối, thay vì tạo thêm luồng
+            if not connection_slots.acquire(blocking=False):
+                try:
+                    client_socket.sendall(ERR_SERVER_FULL_BYTES)
+                except OSError:
+                    pass
+                close_socket(client_socket)
+                continue
+            try:
+                # Tắt thuật toán Nagle để các tin nhắn chat nhỏ được gửi đi ngay
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client_socket.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SNDBUF_SIZE
+                )
+                # Để hệ điều hành phát hiện các kết nối đã chết (client mất mạng)
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # Tạo đối tượng ChatClient để quản lý client này
+                chat_client = ChatClient(socket=client_socket)
+                # Tạo một luồng mới để xử lý client này
+                # Điều này cho phép server xử lý nhiều client cùng lúc
+                thread = threading.Thread(target=handle_client, args=(chat_client,))
+                thread.daemon = (
+                    True  # Đặt là daemon để chương trình chính có thể thoát
+                    # ngay cả khi các luồng con đang chạy
+                )
+                thread.start()
+            except Exception:
+                # Chưa giao được kết nối cho luồng xử lý (ví dụ: không tạo được
+                # luồng mới): trả lại chỗ kết nối và đóng socket
+                connection_slots.release()
+                close_socket(client_socket)
+                raise
         except KeyboardInterrupt:
             print("\nServer shutting down...")
-            close_socket(server_socket)
+            close_socket(server_socket, is_connected=False)
             break
         except Exception as e:
             print(f"[ERROR] Error accepting client connection: {e}")
@@ -1,80 +1,227 @@
 """
 Module này chứa các hàm tiện ích được chia sẻ bởi cả Server và Client.
 Các chức năng bao gồm:
-- Tương tác với cơ sở dữ liệu người dùng (file CSV).
+- Lưu trữ dữ liệu người dùng (dict trong bộ nhớ + SQLite).
 - Đóng socket một cách an toàn.
 - Các hàm giao diện dòng lệnh (CLI) để lấy thông tin từ người dùng.
 """
 
+import base64
+import csv
 import getpass
+import hashlib
+import hmac
+import os
+from pathlib import Path
+import queue
 import socket
+import sqlite3
+import struct
+import sys
+import threading
+from typing import Dict, Optional
 
-import pandas as pd
+from configs import INITIAL_RECV_BUFFER_SIZE, QUIT_COMMAND, RECV_BUFFER_SIZE
+from schemas import FRAME_HEADER, AuthAction
 
-from configs import QUIT_COMMAND
-from schemas import AuthAction
+# --- Lưu trữ người dùng ---
 
-# --- Các hàm xử lý Cơ sở dữ liệu (Pandas) ---
+# Mật khẩu được lưu dưới dạng "scrypt$" + base64(salt || digest)
+PASSWORD_HASH_PREFIX = "scrypt$"
+PASSWORD_SALT_SIZE = 16  # bytes
+# Tham số scrypt (n=2**14, r=8 dùng khoảng 16MB bộ nhớ cho mỗi lần băm)
+SCRYPT_PARAMS = {"n": 2**14, "r": 8, "p": 1, "dklen": 32}
 
 
-def add_new_user_to_db(
-    current_df: pd.DataFrame, username: str, password: str
-) -> pd.DataFrame:
+def hash_password(password: str) -> str:
     """
-    Thêm một người dùng mới vào DataFrame và trả về DataFrame đã cập nhật.
-    Không lưu trực tiếp xuống file CSV, chỉ thao tác trên bộ nhớ.
+    Băm mật khẩu bằng scrypt với một salt ngẫu nhiên.
 
     Args:
-        current_df (pd.DataFrame): DataFrame hiện tại chứa dữ liệu người dùng.
-        username (str): Tên người dùng mới.
-        password (str): Mật khẩu của người dùng mới.
+        password (str): Mật khẩu dạng văn bản.
 
     Returns:
-        pd.DataFrame: DataFrame đã được cập nhật với người dùng mới.
+        str: Chuỗi "scrypt$" + base64(salt || digest) để lưu trữ.
     """
-    if username in current_df["username"].values:
-        return current_df  # Username already exists
-    new_user = pd.DataFrame({"username": [username], "password": [password]})
-    current_df = pd.concat([current_df, new_user], ignore_index=True)
-    return current_df
+    salt = os.urandom(PASSWORD_SALT_SIZE)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, **SCRYPT_PARAMS)
+    return PASSWORD_HASH_PREFIX + base64.b64encode(salt + digest).decode("ascii")
 
 
-def verify_user_credentials(df: pd.DataFrame, username: str, password: str) -> bool:
+def check_password(password: str, stored_hash: str) -> bool:
     """
-    Xác minh thông tin đăng nhập của người dùng dựa trên DataFrame.
+    Kiểm tra mật khẩu với giá trị băm đã lưu.
 
     Args:
-        df (pd.DataFrame): DataFrame chứa dữ liệu người dùng.
-        username (str): Tên người dùng cần kiểm tra.
-        password (str): Mật khẩu cần kiểm tra.
+        password (str): Mật khẩu người dùng nhập.
+        stored_hash (str): Giá trị do `hash_password` tạo ra.
 
     Returns:
-        bool: True nếu thông tin chính xác, False nếu ngược lại.
+        bool: True nếu mật khẩu khớp, False nếu ngược lại.
     """
-    # Tìm dòng (row) có username khớp
-    user_row = df[df["username"] == username]
-    # Nếu không tìm thấy (DataFrame rỗng)
-    if user_row.empty:
-        return False
-    # Lấy mật khẩu đã lưu và so sánh
-    current_password = str(user_row["password"].iloc[0])
-    return current_password == password
+    raw = base64.b64decode(stored_hash[len(PASSWORD_HASH_PREFIX) :])
+    salt, digest = raw[:PASSWORD_SALT_SIZE], raw[PASSWORD_SALT_SIZE:]
+    computed = hashlib.scrypt(password.encode("utf-8"), salt=salt, **SCRYPT_PARAMS)
+    # So sánh với thời gian không phụ thuộc vào vị trí byte khác nhau
+    return hmac.compare_digest(digest, computed)
+
+
+class UserStore:
+    """
+    Kho dữ liệu người dùng: một dict username -> mật khẩu đã băm trong bộ nhớ
+    (tra cứu và thêm mới O(1)), được lưu bền vào một bảng SQLite.
+    Mọi lần đăng nhập chỉ đọc từ dict, cơ sở dữ liệu chỉ được ghi khi
+    có người dùng mới đăng ký.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, str] = {}
+        # Khóa cho thao tác kiểm tra và thêm vào dict (không giữ khi ghi đĩa)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # Khóa cho kết nối cơ sở dữ liệu dùng chung giữa các luồng
+        self._db_lock = threading.Lock()
+        self._dummy_hash: Optional[str] = None
+
+    def load(self, db_file: Path, legacy_csv: Path):
+        """
+        Mở (hoặc tạo) cơ sở dữ liệu và tải toàn bộ người dùng vào bộ nhớ.
+        Nếu cơ sở dữ liệu còn trống mà file CSV cũ tồn tại, dữ liệu trong
+        file CSV sẽ được nhập vào một lần. Mật khẩu còn lưu dạng văn bản
+        (từ các phiên bản cũ) được băm lại khi tải, sau đó file CSV (chứa
+        mật khẩu dạng văn bản) bị xóa.
+
+        Args:
+            db_file (Path): Đường dẫn đến file SQLite.
+            legacy_csv (Path): Đường dẫn đến file CSV của các phiên bản cũ.
+        """
+        os.makedirs(db_file.parent, exist_ok=True)
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS users "
+                "(username TEXT PRIMARY KEY, password TEXT NOT NULL)"
+            )
+        is_empty = self._db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+        imported_csv = is_empty and os.path.exists(legacy_csv)
+        if imported_csv:
+            with open(legacy_csv, newline="", encoding="utf-8") as f:
+                rows = [(row["username"], row["password"]) for row in csv.DictReader(f)]
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+                    rows,
+                )
+        rows = self._db.execute("SELECT username, password FROM users").fetchall()
+        plaintext = [
+            (hash_password(password), username)
+            for username, password in rows
+            if not password.startswith(PASSWORD_HASH_PREFIX)
+        ]
+        if plaintext:
+            with self._db:
+                self._db.executemany(
+                    "UPDATE users SET password = ? WHERE username = ?", plaintext
+                )
+            rows = self._db.execute("SELECT username, password FROM users").fetchall()
+        if imported_csv:
+            # Mật khẩu đã được băm và lưu vào SQLite: không giữ lại bản văn bản
+            os.remove(legacy_csv)
+        self._users.update(rows)
+        # Giá trị băm giả để username không tồn tại cũng tốn thời gian như
+        # username có thật, không để lộ qua thời gian phản hồi
+        self._dummy_hash = hash_password("")
+
+    def add_new_user_to_db(self, username: str, password: str) -> bool:
+        """
+        Thêm một người dùng mới vào bộ nhớ và lưu xuống cơ sở dữ liệu.
+
+        Args:
+            username (str): Tên người dùng mới.
+            password (str): Mật khẩu của người dùng mới (chỉ lưu giá trị băm).
+
+        Returns:
+            bool: True nếu đã thêm, False nếu username đã tồn tại.
+        """
+        if username in self._users:
+            return False  # Username already exists
+        # Băm bên ngoài khóa vì scrypt cố tình chậm
+        password_hash = hash_password(password)
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users[username] = password_hash
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                (username, password_hash),
+            )
+        return True
+
+    def verify_user_credentials(self, username: str, password: str) -> bool:
+        """
+        Xác minh thông tin đăng nhập của người dùng.
+
+        Args:
+            username (str): Tên người dùng cần kiểm tra.
+            password (str): Mật khẩu cần kiểm tra.
+
+        Returns:
+            bool: True nếu thông tin chính xác, False nếu ngược lại.
+        """
+        # Tra cứu O(1) thay vì lọc toàn bộ bảng
+        stored_hash = self._users.get(username)
+        if stored_hash is None:
+            # Vẫn chạy scrypt để thời gian phản hồi không tiết lộ username
+            # nào đã tồn tại
+            if self._dummy_hash is not None:
+                check_password(password, self._dummy_hash)
+            return False
+        return check_password(password, stored_hash)
 
 
 # --- Hàm xử lý Mạng (Socket) ---
 
+# Cờ cho send() để gửi mà không chờ khi bộ đệm gửi của socket đã đầy.
+# MSG_DONTWAIT không có trên Windows; ở đó việc gửi không chờ dựa vào socket
+# của client đã đăng nhập được đặt ở chế độ không chặn (setblocking(False)).
+NONBLOCKING_SEND_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
 
-def close_socket(sock: socket.socket):
+# Giá trị SO_LINGER {bật, 0 giây}: close() gửi RST và giải phóng kết nối ngay,
+# không đi qua trạng thái TIME_WAIT
+ABORTIVE_LINGER = struct.pack("ii", 1, 0)
+
+
+def close_socket(sock: socket.socket, is_connected: bool = True, force: bool = False):
     """
     Đóng một đối tượng socket một cách an toàn và triệt để.
     Hàm này xử lý các trường hợp socket đã bị đóng hoặc chưa kết nối.
 
     Args:
         sock (socket.socket): Đối tượng socket cần đóng.
+        is_connected (bool): False với socket chưa từng kết nối (socket lắng
+            nghe, kết nối thất bại) để bỏ qua shutdown() vốn chắc chắn lỗi.
+        force (bool): True với kết nối đến client đã hỏng (quá hạn, gửi thất
+            bại): đóng ngay bằng RST thay vì kết thúc kết nối bình thường.
     """
     # fileno() == -1 có nghĩa là socket đã bị đóng
     if sock.fileno() == -1:
         return
+    if not is_connected:
+        sock.close()
+        return
+    if force:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, ABORTIVE_LINGER)
+        except OSError:
+            pass
+        sock.close()
+        return
+    # Socket đang có lỗi (bị reset, mạng không tới được): shutdown() chắc chắn
+    # thất bại, chỉ cần đóng
+    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+        sock.close()
+        return
     try:
         # Thông báo cho cả hai chiều (đọc và ghi) rằng kết nối sắp đóng
         sock.shutdown(socket.SHUT_RDWR)
@@ -86,9 +233,201 @@ def close_socket(sock: socket.socket):
         sock.close()
 
 
+def recv_exact_into(sock: socket.socket, view: memoryview) -> bool:
+    """
+    Nhận dữ liệu cho đến khi lấp đầy `view` (TCP có thể trả về ít hơn
+    số byte yêu cầu trong mỗi lần recv).
+
+    Args:
+        sock (socket.socket): Socket để nhận dữ liệu.
+        view (memoryview): Vùng nhớ cần lấp đầy.
+
+    Returns:
+        bool: True nếu nhận đủ, False nếu bên kia đã đóng kết nối.
+    """
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return False
+        received += n
+    return True
+
+
+def read_frame_length(header: memoryview) -> int:
+    """
+    Đọc độ dài nội dung từ header của một frame.
+
+    Args:
+        header (memoryview): Vùng nhớ chứa header (FRAME_HEADER.size byte).
+
+    Returns:
+        int: Độ dài nội dung của frame.
+
+    Raises:
+        ValueError: Nếu frame lớn hơn RECV_BUFFER_SIZE.
+    """
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > RECV_BUFFER_SIZE:
+        raise ValueError(f"Frame too large ({length} bytes).")
+    return length
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytes]:
+    """
+    Nhận đúng một frame từ socket và trả về phần nội dung (JSON).
+
+    Args:
+        sock (socket.socket): Socket để nhận dữ liệu.
+
+    Returns:
+        bytes: Nội dung của frame.
+        None: Nếu bên kia đã đóng kết nối.
+    """
+    header = memoryview(bytearray(FRAME_HEADER.size))
+    if not recv_exact_into(sock, header):
+        return None
+    payload = bytearray(read_frame_length(header))
+    if not recv_exact_into(sock, memoryview(payload)):
+        return None
+    return bytes(payload)
+
+
+# Vùng dùng chung các bộ đệm lớn (đủ cho frame lớn nhất). FrameReader chỉ
+# mượn một bộ đệm khi gặp frame không vừa bộ đệm nhỏ của nó, và trả lại
+# ngay khi đã xử lý xong, nên các kết nối nhàn rỗi không giữ bộ đệm lớn.
+_large_buffers: "queue.SimpleQueue[bytearray]" = queue.SimpleQueue()
+LARGE_BUFFER_SIZE = FRAME_HEADER.size + RECV_BUFFER_SIZE
+
+
+class FrameReader:
+    """
+    Bộ đọc frame có bộ đệm. Mỗi lần recv lấy nhiều dữ liệu nhất có thể
+    vào một bộ đệm cấp phát sẵn, sau đó tách lần lượt từng frame hoàn chỉnh.
+    Nhờ vậy nhiều tin nhắn đến cùng lúc chỉ tốn một lần gọi recv, và một
+    tin nhắn bị chia nhỏ qua nhiều lần recv vẫn được ghép lại đúng.
+    """
+
+    __slots__ = ("_small", "_buf", "_view", "_start", "_end")
+
+    def __init__(self):
+        # Bộ đệm nhỏ đủ cho các tin nhắn chat thông thường
+        self._small = bytearray(INITIAL_RECV_BUFFER_SIZE)
+        self._buf = self._small  # Bộ đệm đang dùng (nhỏ, hoặc lớn mượn từ pool)
+        self._view = memoryview(self._buf)
+        self._start = 0  # Vị trí bắt đầu của phần dữ liệu chưa xử lý
+        self._end = 0  # Vị trí kết thúc của phần dữ liệu đã nhận
+
+    def _switch_buffer(self, buf: bytearray):
+        """
+        Chuyển phần dữ liệu chưa xử lý sang bộ đệm `buf` và dùng bộ đệm đó.
+        Bộ đệm lớn đang dùng (nếu có) được trả lại pool.
+        """
+        available = self._end - self._start
+        view = memoryview(buf)
+        view[:available] = self._view[self._start : self._end]
+        if self._buf is not self._small:
+            _large_buffers.put(self._buf)
+        self._buf, self._view = buf, view
+        self._start, self._end = 0, available
+
+    def _next_frame_size(self) -> int:
+        """
+        Trả về tổng số byte (header + nội dung) của frame tiếp theo, hoặc chỉ
+        kích thước header nếu chưa nhận đủ header.
+        """
+        header_size = FRAME_HEADER.size
+        if self._end - self._start < header_size:
+            return header_size
+        header = self._view[self._start : self._start + header_size]
+        return header_size + read_frame_length(header)
+
+    def next_frame(self) -> Optional[memoryview]:
+        """
+        Tách frame hoàn chỉnh tiếp theo đã có trong bộ đệm (không gọi recv).
+
+        Returns:
+            memoryview: Nội dung (JSON) của frame, trỏ vào bộ đệm nội bộ và chỉ
+                        hợp lệ cho đến lần gọi `next_frame`/`fill` tiếp theo.
+            None: Nếu trong bộ đệm chưa có đủ một frame.
+        """
+        # Frame lớn trước đó đã được xử lý xong: trả bộ đệm lớn lại pool
+        if self._buf is not self._small and self._end - self._start <= len(self._small):
+            self._switch_buffer(self._small)
+        size = self._next_frame_size()
+        if self._end - self._start < size:
+            return None
+        body_start = self._start + FRAME_HEADER.size
+        self._start += size
+        return self._view[body_start : self._start]
+
+    def fill(self, sock: socket.socket) -> bool:
+        """
+        Gọi recv đúng một lần để nhận thêm dữ liệu vào bộ đệm. Chỉ chờ nếu
+        socket chưa có dữ liệu, nên có thể gọi ngay khi selector báo socket
+        sẵn sàng đọc mà không bị block.
+
+        Args:
+            sock (socket.socket): Socket để nhận dữ liệu.
+
+        Returns:
+            bool: False nếu bên kia đã đóng kết nối, True nếu ngược lại.
+        """
+        available = self._end - self._start
+        if self._next_frame_size() > len(self._buf):
+            # Frame không vừa bộ đệm nhỏ: mượn một bộ đệm lớn
+            try:
+                large = _large_buffers.get_nowait()
+            except queue.Empty:
+                large = bytearray(LARGE_BUFFER_SIZE)
+            self._switch_buffer(large)
+        elif self._start:
+            # Chưa đủ một frame: dồn phần dữ liệu còn dở về đầu bộ đệm
+            # để có chỗ nhận tiếp
+            self._view[:available] = self._view[self._start : self._end]
+            self._start, self._end = 0, available
+        n = sock.recv_into(self._view[self._end :])
+        if n == 0:
+            return False
+        self._end += n
+        return True
+
+    def read_frame(self, sock: socket.socket) -> Optional[memoryview]:
+        """
+        Trả về nội dung của frame tiếp theo, chỉ gọi recv khi trong bộ đệm
+        chưa có đủ một frame hoàn chỉnh.
+
+        Args:
+            sock (socket.socket): Socket để nhận dữ liệu.
+
+        Returns:
+            memoryview: Nội dung (JSON) của frame, trỏ vào bộ đệm nội bộ và chỉ
+                        hợp lệ cho đến lần gọi `read_frame` tiếp theo.
+            None: Nếu bên kia đã đóng kết nối.
+        """
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            if not self.fill(sock):
+                return None
+
+
 # --- Các hàm Giao diện Người dùng (CLI) ---
 
 
+# Lời nhắc và bảng lựa chọn của menu xác thực, tạo sẵn một lần
+AUTH_MENU_PROMPT = (
+    f"Select '1' to {AuthAction.LOGIN.value},"
+    f"'2' to {AuthAction.REGISTER.value},"
+    f"'{QUIT_COMMAND}' to quit: "
+)
+AUTH_MENU_CHOICES: Dict[str, AuthAction] = {
+    "1": AuthAction.LOGIN,
+    "2": AuthAction.REGISTER,
+}
+
+
 def request_user_login_register() -> AuthAction:
     """
     Hiển thị menu cho người dùng chọn Đăng nhập hoặc Đăng ký.
@@ -98,21 +437,15 @@ def request_user_login_register() -> AuthAction:
                     hoặc None nếu người dùng muốn thoát.
     """
     while True:
-        action = input(
-            f"Select '1' to {AuthAction.LOGIN.value},"
-            f"'2' to {AuthAction.REGISTER.value},"
-            f"'{QUIT_COMMAND}' to quit: "
-        ).strip()
+        action = input(AUTH_MENU_PROMPT).strip()
 
         if action == QUIT_COMMAND:
             return None
 
-        if action == "1":
-            return AuthAction.LOGIN
-        elif action == "2":
-            return AuthAction.REGISTER
-        else:
-            print("Invalid option. Please choose '1' or '2'.")
+        choice = AUTH_MENU_CHOICES.get(action)
+        if choice is not None:
+            return choice
+        print("Invalid option. Please choose '1' or '2'.")
 
 
 def get_user_credentials() -> tuple[str, str]:
@@ -124,7 +457,12 @@ def get_user_credentials() -> tuple[str, str]:
         tuple[str, str]: (username, password).
                          Trả về (None, None) nếu người dùng nhập rỗng.
     """
-    username = input("Enter username: ").strip()
+    # Đọc trực tiếp từ sys.stdin thay vì input(); strip() đồng thời bỏ ký tự
+    # xuống dòng và khoảng trắng thừa (username không được chứa khoảng trắng
+    # ở hai đầu vì lệnh /pm tách tên theo dấu cách)
+    sys.stdout.write("Enter username: ")
+    sys.stdout.flush()
+    username = sys.stdin.readline().strip()
     # getpass.getpass() tự động ẩn mật khẩu khi người dùng gõ
     password = getpass.getpass("Enter password: ")
     # Kiểm tra xem người dùng có nhập rỗng không
@@ -1,16 +1,16 @@
 """
 Test sau khi thiết lập môi trường.
-Kiểm tra xem tất cả các module cần thiết có thể được nhập thành công hay không.
-In ra "Hello, World!" nếu tất cả các module được nhập thành công.
+Kiểm tra xem tất cả các module cần thiết đã được cài đặt hay chưa.
+In ra "Hello, World!" nếu tất cả các module đều có sẵn.
 """
 
-import socket
-import threading
-import time
-import pandas as pd
-import numpy as np
+from importlib.util import find_spec
 import sys
 
+# Các module cần có trong môi trường. Chỉ tìm (find_spec) chứ không nhập,
+# để kiểm tra nhanh mà không phải nạp các thư viện bên ngoài như pydantic.
+REQUIRED_MODULES = ("socket", "threading", "time", "sqlite3", "pydantic")
+
 
 def assert_python_version():
     """Đảm bảo phiên bản Python là 3.9 hoặc cao hơn."""
@@ -21,7 +21,15 @@ def assert_python_version():
         )
 
 
+def assert_modules_available():
+    """Đảm bảo tất cả các module trong REQUIRED_MODULES đều đã được cài đặt."""
+    for name in REQUIRED_MODULES:
+        if find_spec(name) is None:
+            raise EnvironmentError(f"Required module '{name}' is not installed.")
+
+
 if __name__ == "__main__":
     assert_python_version()
+    assert_modules_available()
     print("Hello, World!")
-    print("All modules imported successfully.")
+    print("All required modules are available.")